@@ -1,4 +1,5 @@
 import asyncio
+import functools
 import json
 import logging
 import os
@@ -8,15 +9,59 @@ from shutil import copyfile
 from typing import Optional
 
 import discord
-from PIL import Image, ImageChops, ImageColor, ImageOps
+import numpy
+from PIL import Image, ImageColor
 from discord.ext.commands import Greedy
 from redbot.core import Config, commands
 from redbot.core.bot import Red
 from redbot.core.data_manager import bundled_data_path, cog_data_path
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 log = logging.getLogger("red.fox_v3.conquest")
 
 
+def _json_load(path: pathlib.Path):
+    if orjson is not None:
+        return orjson.loads(path.read_bytes())
+    with path.open() as f:
+        return json.load(f)
+
+
+def _json_dump(data, path: pathlib.Path):
+    if orjson is not None:
+        path.write_bytes(orjson.dumps(data))
+    else:
+        with path.open("w") as f:
+            json.dump(data, f)
+
+
+@functools.lru_cache(maxsize=256)
+def _load_mask(path_str: str, mtime_ns: int):
+    """
+    Decoded mask cache. Keyed on mtime so edited masks aren't served stale.
+
+    Masks are held bit-packed (one bit per foreground pixel), an eighth of
+    the memory of the decoded image; callers unpack on use.
+    """
+    with Image.open(path_str) as mask:
+        foreground = numpy.asarray(mask.convert("L")) < 128
+    return numpy.packbits(foreground), foreground.shape
+
+
+@functools.lru_cache(maxsize=8)
+def _load_labels(path_str: str, mtime_ns: int) -> numpy.ndarray:
+    """
+    Packed region labels (masks.npz written by Regioner), one array for
+    every mask of a map.
+    """
+    with numpy.load(path_str) as data:
+        return data["labels"]
+
+
 class Conquest(commands.Cog):
     """
     Cog for
@@ -43,6 +88,7 @@ class Conquest(commands.Cog):
         self.map_data = None
         self.ext = None
         self.ext_format = None
+        self.save_kwargs = {}
 
     async def red_delete_data_for_user(self, **kwargs):
         """Nothing to delete"""
@@ -65,10 +111,14 @@ class Conquest(commands.Cog):
             log.warning(f"{map_data_path} does not exist. Clearing current map")
             return False
 
-        with map_data_path.open() as mapdata:
-            self.map_data: dict = json.load(mapdata)
+        self.map_data: dict = _json_load(map_data_path)
         self.ext = self.map_data["extension"]
         self.ext_format = "JPEG" if self.ext.upper() == "JPG" else self.ext.upper()
+        # These maps are intermediates that get re-encoded on every claim;
+        # favor encode speed over size for them
+        self.save_kwargs = (
+            {"compress_level": 1, "optimize": False} if self.ext_format == "PNG" else {}
+        )
         return True
 
     @commands.group()
@@ -86,10 +136,8 @@ class Conquest(commands.Cog):
         """
         maps_json = self.asset_path / "maps.json"
 
-        with maps_json.open() as maps:
-            maps_json = json.load(maps)
-            map_list = "\n".join(maps_json["maps"])
-            await ctx.maybe_send_embed(f"Current maps:\n{map_list}")
+        map_list = "\n".join(_json_load(maps_json)["maps"])
+        await ctx.maybe_send_embed(f"Current maps:\n{map_list}")
 
     @conquest.group(name="set")
     async def conquest_set(self, ctx: commands.Context):
@@ -110,8 +158,7 @@ class Conquest(commands.Cog):
             )
             return
 
-        with zoom_json_path.open("w+") as zoom_json:
-            json.dump({"enabled": False}, zoom_json)
+        _json_dump({"enabled": False}, zoom_json_path)
 
         await ctx.tick()
 
@@ -140,8 +187,7 @@ class Conquest(commands.Cog):
         zoom_data["y"] = y
         zoom_data["zoom"] = zoom
 
-        with zoom_json_path.open("w+") as zoom_json:
-            json.dump(zoom_data, zoom_json)
+        _json_dump(zoom_data, zoom_json_path)
 
         await ctx.tick()
 
@@ -174,13 +220,19 @@ class Conquest(commands.Cog):
         )
 
     async def _create_zoomed_map(self, map_path, x, y, zoom, **kwargs):
-        current_map = Image.open(map_path)
-
-        w, h = current_map.size
-        zoom2 = zoom * 2
-        zoomed_map = current_map.crop((x - w / zoom2, y - h / zoom2, x + w / zoom2, y + h / zoom2))
-        # zoomed_map = zoomed_map.resize((w, h), Image.LANCZOS)
-        zoomed_map.save(self.data_path / self.current_map / f"zoomed.{self.ext}", self.ext_format)
+        with Image.open(map_path) as current_map:
+            # size comes from the header; nothing is decoded until crop
+            w, h = current_map.size
+            zoom2 = zoom * 2
+            zoomed_map = current_map.crop(
+                (x - w / zoom2, y - h / zoom2, x + w / zoom2, y + h / zoom2)
+            )
+            # zoomed_map = zoomed_map.resize((w, h), Image.LANCZOS)
+            zoomed_map.save(
+                self.data_path / self.current_map / f"zoomed.{self.ext}",
+                self.ext_format,
+                **self.save_kwargs,
+            )
         return self.data_path / self.current_map / f"zoomed.{self.ext}"
 
     @conquest_set.command(name="save")
@@ -277,8 +329,7 @@ class Conquest(commands.Cog):
         zoom_json_path = self.data_path / self.current_map / "settings.json"
 
         if zoom_json_path.exists():
-            with zoom_json_path.open() as zoom_json:
-                zoom_data = json.load(zoom_json)
+            zoom_data = _json_load(zoom_json_path)
 
         if zoom_data["enabled"]:
             map_path = await self._create_zoomed_map(map_path, **zoom_data)
@@ -317,27 +368,34 @@ class Conquest(commands.Cog):
             )
             return
 
-        current_map = Image.open(self.data_path / self.current_map / f"current.{self.ext}")
-        numbers = Image.open(numbers_path).convert("L")
-
-        inverted_map = ImageOps.invert(current_map)
-
         loop = asyncio.get_running_loop()
-        current_numbered_img = await loop.run_in_executor(
-            None, Image.composite, current_map, inverted_map, numbers
-        )
-
-        current_numbered_img.save(
-            self.data_path / self.current_map / f"current_numbered.{self.ext}",
-            self.ext_format,
+        current_numbered_path = await loop.run_in_executor(
+            None, self._create_numbered_map, numbers_path
         )
 
         await self._send_maybe_zoomed_map(
             ctx,
-            self.data_path / self.current_map / f"current_numbered.{self.ext}",
+            current_numbered_path,
             f"current_numbered.{self.ext}",
         )
 
+    def _create_numbered_map(self, numbers_path):
+        """Runs in a thread: decode, overlay the numbers, and save the result."""
+        with Image.open(self.data_path / self.current_map / f"current.{self.ext}") as current_map:
+            current_arr = numpy.asarray(current_map.convert("RGB"))
+        with Image.open(numbers_path) as numbers:
+            numbers_arr = numpy.asarray(numbers.convert("L"))
+
+        # Equivalent to compositing a fully inverted copy under the number
+        # mask, but only the pixels beneath the digits are ever touched
+        out_arr = numpy.where(numbers_arr[..., None] < 128, 255 - current_arr, current_arr)
+
+        current_numbered_path = self.data_path / self.current_map / f"current_numbered.{self.ext}"
+        Image.fromarray(out_arr, "RGB").save(
+            current_numbered_path, self.ext_format, **self.save_kwargs
+        )
+        return current_numbered_path
+
     @conquest.command(name="multitake")
     async def _conquest_multitake(
         self, ctx: commands.Context, start_region: int, end_region: int, color: str
@@ -357,16 +415,22 @@ class Conquest(commands.Cog):
                 f"Max region number is {self.map_data['region_max']}, minimum is 1"
             )
             return
+
+        if start_region > end_region:
+            await ctx.send_help()
+            return
+
         regions = [r for r in range(start_region, end_region + 1)]
 
         await self._process_take_regions(color, ctx, regions)
 
     async def _process_take_regions(self, color, ctx, regions):
         current_img_path = self.data_path / self.current_map / f"current.{self.ext}"
-        im = Image.open(current_img_path)
         async with ctx.typing():
-            out: Image.Image = await self._composite_regions(im, regions, color)
-            out.save(current_img_path, self.ext_format)
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(
+                None, self._composite_regions, current_img_path, regions, color
+            )
             await self._send_maybe_zoomed_map(ctx, current_img_path, f"map.{self.ext}")
 
     @conquest.command(name="take")
@@ -400,24 +464,34 @@ class Conquest(commands.Cog):
 
         await self._process_take_regions(color, ctx, regions)
 
-    async def _composite_regions(self, im, regions, color) -> Image.Image:
-        im2 = Image.new("RGB", im.size, color)
-
-        loop = asyncio.get_running_loop()
+    def _composite_regions(self, current_img_path, regions, color):
+        """Runs in a thread: decode the masks and map, blend the claim, and save."""
+        if not regions:  # nothing to claim, leave the map untouched
+            return
 
-        combined_mask = None
-        for region in regions:
-            mask = Image.open(
-                self.asset_path / self.current_map / "masks" / f"{region}.{self.ext}"
-            ).convert("L")
-            if combined_mask is None:
-                combined_mask = mask
-            else:
-                # combined_mask = ImageChops.logical_or(combined_mask, mask)
-                combined_mask = await loop.run_in_executor(
-                    None, ImageChops.multiply, combined_mask, mask
-                )
+        npz_path = self.asset_path / self.current_map / "masks" / "masks.npz"
+        if npz_path.exists():
+            labels = _load_labels(str(npz_path), npz_path.stat().st_mtime_ns)
+            claimed = numpy.isin(labels, regions)
+        else:
+            packed_masks = []
+            shape = None
+            for region in regions:
+                mask_path = self.asset_path / self.current_map / "masks" / f"{region}.{self.ext}"
+                packed, shape = _load_mask(str(mask_path), mask_path.stat().st_mtime_ns)
+                packed_masks.append(packed)
+            # the union of the packed masks is a bitwise-or over an eighth
+            # of the bytes; unpack the combined result once
+            combined = numpy.bitwise_or.reduce(packed_masks)
+            claimed = (
+                numpy.unpackbits(combined, count=shape[0] * shape[1])
+                .reshape(shape)
+                .astype(numpy.bool_)
+            )
 
-        out = await loop.run_in_executor(None, Image.composite, im, im2, combined_mask)
+        with Image.open(current_img_path) as im:
+            im_arr = numpy.asarray(im.convert("RGB"))
+        color_arr = numpy.array(color, dtype=numpy.uint8)
+        out_arr = numpy.where(claimed[..., None], color_arr, im_arr)
 
-        return out
+        Image.fromarray(out_arr, "RGB").save(current_img_path, self.ext_format, **self.save_kwargs)
@@ -1,24 +1,106 @@
 import os
 import pathlib
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy
 from PIL import Image, ImageColor, ImageFont, ImageOps, ImageDraw
 from PIL.ImageDraw import _color_diff
 
+try:
+    from scipy import ndimage
+except ImportError:
+    ndimage = None
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+# 1-bit masks: an eighth of the bytes of "L" both on disk and decoded
+MASK_MODE = "1"
+
+
+def _floodfill_array(arr, visited, start_y, start_x, wall_color, fill_color):
+    """
+    Stack-based 4-connected fill over a grayscale array, spreading to any
+    pixel that is neither wall nor fill color — the same border semantics
+    as the PIL floodfill below, so anti-aliased edge pixels are included.
+
+    Written against the numba nopython subset so it can be JIT-compiled
+    below; also runs as plain Python.
+    """
+    height, width = arr.shape
+    stack = numpy.empty((height * width, 2), dtype=numpy.int64)
+    filled = numpy.zeros((height, width), dtype=numpy.bool_)
+    stack[0, 0] = start_y
+    stack[0, 1] = start_x
+    visited[start_y, start_x] = True
+    top = 1
+    while top > 0:
+        top -= 1
+        y = stack[top, 0]
+        x = stack[top, 1]
+        filled[y, x] = True
+        for t, s in ((y + 1, x), (y - 1, x), (y, x + 1), (y, x - 1)):
+            if 0 <= t < height and 0 <= s < width and not visited[t, s]:
+                if arr[t, s] != wall_color and arr[t, s] != fill_color:
+                    visited[t, s] = True
+                    stack[top, 0] = t
+                    stack[top, 1] = s
+                    top += 1
+    return filled
+
+
+if njit is not None:
+    _floodfill_array = njit(cache=True)(_floodfill_array)
+
+
+def sort_labels(labels: numpy.ndarray, label_count: int) -> numpy.ndarray:
+    """
+    Renumber labels by the raster position of each region's first pixel so
+    mask numbers read top-to-bottom then left-to-right, equivalent to a
+    lexsort on (x, y) of each region's topmost pixel but done in one
+    vectorized pass over the labels array.
+    """
+    unique_labels, first_idx = numpy.unique(labels.ravel(), return_index=True)
+    # a map with no wall pixels has no background label 0; don't assume
+    # the first unique row is it
+    foreground = unique_labels != 0
+    unique_labels = unique_labels[foreground]
+    first_idx = first_idx[foreground]
+    order = numpy.argsort(first_idx)
+    remap = numpy.zeros(label_count + 1, dtype=labels.dtype)
+    remap[unique_labels[order]] = numpy.arange(1, unique_labels.size + 1, dtype=labels.dtype)
+    return remap[labels]
+
+
+def get_points_from_mask(mask_arr: numpy.ndarray) -> numpy.ndarray:
+    """Foreground (value 0) pixels of a mask array as an (N, 2) array of (x, y)."""
+    ys, xs = numpy.nonzero(mask_arr == 0)
+    return numpy.column_stack((xs, ys))
+
 
 def get_center(points):
     """
     Taken from https://stackoverflow.com/questions/4355894/how-to-get-center-of-set-of-points-using-python
     """
+    if isinstance(points, numpy.ndarray):
+        return float(points[:, 0].mean()), float(points[:, 1].mean())
     x = [p[0] for p in points]
     y = [p[1] for p in points]
     return sum(x) / len(points), sum(y) / len(points)
 
 
-def floodfill(image, xy, value, border=None, thresh=0) -> set:
+def floodfill(image, xy, value, border=None, thresh=0):
     """
     Taken and modified from PIL.ImageDraw.floodfill
 
     (experimental) Fills a bounded region with a given color.
 
+    Returns a boolean array of the filled pixels, or None if the seed
+    point was invalid.
+
     :param image: Target image.
     :param xy: Seed position (a 2-item coordinate tuple). See
         :ref:`coordinate-system`.
@@ -39,37 +121,34 @@ def floodfill(image, xy, value, border=None, thresh=0) -> set:
     try:
         background = pixel[x, y]
         if _color_diff(value, background) <= thresh:
-            return set()  # seed point already has fill color
+            return None  # seed point already has fill color
         pixel[x, y] = value
     except (ValueError, IndexError):
-        return set()  # seed point outside image
-    edge = {(x, y)}
-    # use a set to keep record of current and previous edge pixels
-    # to reduce memory consumption
-    filled_pixels = set()
-    full_edge = set()
+        return None  # seed point outside image
+    width, height = image.size
+    # boolean arrays instead of coordinate sets: O(1) membership with no
+    # per-pixel tuple allocation or hashing
+    filled_pixels = numpy.zeros((height, width), dtype=numpy.bool_)
+    full_edge = numpy.zeros((height, width), dtype=numpy.bool_)
+    filled_pixels[y, x] = True
+    edge = [(x, y)]
     while edge:
-        filled_pixels.update(edge)
-        new_edge = set()
+        new_edge = []
         for x, y in edge:  # 4 adjacent method
             for s, t in ((x + 1, y), (x - 1, y), (x, y + 1), (x, y - 1)):
-                # If already processed, or if a coordinate is negative, skip
-                if (s, t) in full_edge or s < 0 or t < 0:
+                # If already processed, or out of bounds, skip
+                if s < 0 or t < 0 or s >= width or t >= height or full_edge[t, s]:
                     continue
-                try:
-                    p = pixel[s, t]
-                except (ValueError, IndexError):
-                    pass
+                p = pixel[s, t]
+                full_edge[t, s] = True
+                if border is None:
+                    fill = _color_diff(p, background) <= thresh
                 else:
-                    full_edge.add((s, t))
-                    if border is None:
-                        fill = _color_diff(p, background) <= thresh
-                    else:
-                        fill = p not in [value, border]
-                    if fill:
-                        pixel[s, t] = value
-                        new_edge.add((s, t))
-        full_edge = edge  # discard pixels processed
+                    fill = p not in (value, border)
+                if fill:
+                    pixel[s, t] = value
+                    filled_pixels[t, s] = True
+                    new_edge.append((s, t))
         edge = new_edge
     return filled_pixels
 
@@ -94,43 +173,149 @@ class Regioner:
 
         masks_path = self.filepath / "masks"
 
-        if not masks_path.exists():
-            os.makedirs(masks_path)
+        # Generate into a scratch directory and swap it in whole, so a
+        # re-run on a changed map can't leave stale masks from the
+        # previous run mixed in with the new set
+        tmp_path = self.filepath / "masks.tmp"
+        if tmp_path.exists():
+            shutil.rmtree(tmp_path)
+        os.makedirs(tmp_path)
 
-        black = ImageColor.getcolor("black", "L")
-        white = ImageColor.getcolor("white", "L")
+        with Image.open(base_img_path) as opened_img:
+            base_img: Image.Image = opened_img.convert("L")
+
+        if ndimage is not None:
+            mask_centers = self._execute_label(base_img, tmp_path)
+        else:
+            mask_centers = self._execute_floodfill(base_img, tmp_path)
+
+        # Move the old masks aside rather than deleting them outright, so
+        # they survive a crash until the new set has been promoted
+        backup_path = self.filepath / "masks.old"
+        if backup_path.exists():
+            shutil.rmtree(backup_path)
+        if masks_path.exists():
+            os.replace(masks_path, backup_path)
+        os.replace(tmp_path, masks_path)
+        if backup_path.exists():
+            shutil.rmtree(backup_path)
 
-        base_img: Image.Image = Image.open(base_img_path).convert("L")
-        already_processed = set()
+        self.create_number_mask(base_img, mask_centers)
+
+        return mask_centers
+
+    def create_number_mask(self, base_img: Image.Image, mask_centers):
+        """
+        Draw every region number onto one blank image in a single draw pass,
+        centering each number on its region.
+        """
+        number_img = Image.new("L", base_img.size, 255)
+        fnt = ImageFont.load_default()
+        d = ImageDraw.Draw(number_img)
+
+        for mask_num, (x, y) in mask_centers.items():
+            text = str(mask_num)
+            left, top, right, bottom = d.textbbox((0, 0), text, font=fnt)
+            d.text((x - (left + right) / 2, y - (top + bottom) / 2), text, font=fnt, fill=0)
+
+        number_img.save(self.filepath / f"numbers.png", "PNG", compress_level=1)
+
+    def _execute_label(self, base_img: Image.Image, masks_path: pathlib.Path):
+        """
+        Label every connected region in one C-level pass instead of
+        flood filling from each unprocessed seed pixel.
+        """
+        arr = numpy.asarray(base_img)
+        regions = arr == self.region_color
+        labels, label_count = ndimage.label(regions)
+        labels = sort_labels(labels, label_count)
+        centers = ndimage.center_of_mass(regions, labels, range(1, label_count + 1))
+
+        # One packed file holding every mask; consumers that find it can
+        # skip decoding the individual PNGs below. It lives inside the
+        # masks directory so the scratch-dir swap in execute promotes or
+        # discards it together with the PNGs; the fallback paths write no
+        # npz, so theirs swaps any stale one away
+        numpy.savez_compressed(masks_path / "masks.npz", labels=labels)
+
+        def save_mask(label_num):
+            mask_arr = numpy.where(labels == label_num, 0, 255).astype(numpy.uint8)
+            Image.fromarray(mask_arr, "L").convert(MASK_MODE).save(
+                masks_path / f"{label_num}.png", "PNG", compress_level=1
+            )
+
+        # numpy comparisons and zlib compression both release the GIL,
+        # so the per-region saves overlap well in threads
+        with ThreadPoolExecutor() as pool:
+            for _ in pool.map(save_mask, range(1, label_count + 1)):
+                pass
+
+        mask_centers = {}
+        for label_num in range(1, label_count + 1):
+            y, x = centers[label_num - 1]  # center_of_mass returns (row, column)
+            mask_centers[label_num] = (x, y)
+
+        return mask_centers
+
+    def _execute_floodfill(self, base_img: Image.Image, masks_path: pathlib.Path):
+        """
+        Original pixel-by-pixel implementation, kept as a fallback for
+        environments where scipy fails to install.
+        """
+        if njit is not None:
+            return self._execute_floodfill_array(base_img, masks_path)
+
+        black = ImageColor.getcolor("black", "L")
 
         mask_count = 0
         mask_centers = {}
 
-        for y1 in range(base_img.height):
-            for x1 in range(base_img.width):
-                if (x1, y1) in already_processed:
-                    continue
-                if base_img.getpixel((x1, y1)) == self.region_color:
-                    filled = floodfill(base_img, (x1, y1), black, self.wall_color)
-                    if filled:  # Pixels were updated, make them into a mask
-                        mask = Image.new("L", base_img.size, 255)
-                        for x2, y2 in filled:
-                            mask.putpixel((x2, y2), 0)
+        # Snapshot the image once and probe seeds from the array instead of
+        # calling getpixel on every coordinate; filled seeds are skipped via
+        # already_processed, so the stale snapshot values don't matter
+        arr = numpy.asarray(base_img)
+        already_processed = numpy.zeros(arr.shape, dtype=numpy.bool_)
+        for y1, x1 in numpy.argwhere(arr == self.region_color):
+            if already_processed[y1, x1]:
+                continue
+            filled = floodfill(base_img, (x1, y1), black, self.wall_color)
+            if filled is not None and filled.any():  # Pixels were updated, make them into a mask
+                mask_arr = numpy.where(filled, 0, 255).astype(numpy.uint8)
 
-                        mask_count += 1
-                        mask = mask.convert("L")
-                        mask.save(masks_path / f"{mask_count}.png", "PNG")
+                mask_count += 1
+                mask = Image.fromarray(mask_arr, "L").convert(MASK_MODE)
+                mask.save(masks_path / f"{mask_count}.png", "PNG", compress_level=1)
 
-                        mask_centers[mask_count] = get_center(filled)
+                mask_centers[mask_count] = get_center(get_points_from_mask(mask_arr))
 
-                        already_processed.update(filled)
+                already_processed |= filled
 
-        number_img = Image.new("L", base_img.size, 255)
-        fnt = ImageFont.load_default()
-        d = ImageDraw.Draw(number_img)
-        for mask_num, center in mask_centers.items():
-            d.text(center, str(mask_num), font=fnt, fill=0)
+        return mask_centers
+
+    def _execute_floodfill_array(self, base_img: Image.Image, masks_path: pathlib.Path):
+        """
+        Flood fill on a prefetched array with the JIT-compiled kernel,
+        used when numba is installed but scipy is not.
+        """
+        black = ImageColor.getcolor("black", "L")
+
+        arr = numpy.asarray(base_img)
+        visited = numpy.zeros(arr.shape, dtype=numpy.bool_)
+
+        mask_count = 0
+        mask_centers = {}
+
+        for y1, x1 in numpy.argwhere(arr == self.region_color):
+            if visited[y1, x1]:
+                continue
+            filled = _floodfill_array(arr, visited, y1, x1, self.wall_color, black)
+
+            mask_count += 1
+            mask_arr = numpy.where(filled, 0, 255).astype(numpy.uint8)
+            Image.fromarray(mask_arr, "L").convert(MASK_MODE).save(
+                masks_path / f"{mask_count}.png", "PNG", compress_level=1
+            )
 
-        number_img.save(self.filepath / f"numbers.png", "PNG")
+            mask_centers[mask_count] = get_center(get_points_from_mask(mask_arr))
 
         return mask_centers